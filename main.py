@@ -1,22 +1,51 @@
 import asyncio
+import contextlib
+import heapq
 import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+from dataclasses import InitVar, dataclass, field
 from datetime import datetime, timedelta, timezone
+from itertools import starmap
 from pathlib import Path
 import time
-import hashlib
+import secrets
 
 import discord
 from discord.ext import commands, tasks
-from discord import app_commands, Intents, Guild, TextChannel, Thread, Message, Embed, Color, ForumChannel, CategoryChannel 
+from discord import app_commands, Intents, Guild, TextChannel, Thread, Message, Embed, Color, ForumChannel
 
 # --- 全局配置与常量 ---
 CONFIG_FILENAME = "bot_config.json"
 LOG_DIRECTORY = Path("logs")
 LOG_FILENAME = LOG_DIRECTORY / "archiver_bot.log"
 DATA_DIRECTORY = Path("data")
+# 各服务器运行时状态文件所在目录，与 data 根目录下的其他数据文件分开，避免配置名与文件名冲突
+GUILD_STATE_DIRECTORY = DATA_DIRECTORY / "guilds"
+# 可在运行时修改并需要持久化的配置字段，其余字段始终以 GUILD_CONFIGS_JSON 为准
+GUILD_RUNTIME_STATE_KEYS = ("inactivity_days", "max_active_posts", "last_notice_message_id")
+# 周期性审计中同时处理的最大服务器数
+GUILD_AUDIT_CONCURRENCY = 4
+# 全局同时进行的最大 HTTP 请求数（获取最后消息、归档等），由所有并发审计的服务器共享
+HTTP_CONCURRENCY = 16
+# 每个归档请求完成后的等待时间（秒）的初始值与上下限，遇到 429 时翻倍，每批顺利完成后逐步缩短
+ARCHIVE_DELAY_INITIAL = 0.01
+ARCHIVE_DELAY_MIN = 0.005
+ARCHIVE_DELAY_MAX = 1.0
+# 置顶帖保活的令牌桶：最多连续执行的次数，以及每恢复一次所需的秒数
+PINNED_BUMP_BURST = 5
+PINNED_BUMP_REFILL_SECONDS = 4
+# 修改服务器配置后延迟写盘的时间（秒），期间的多次修改合并为一次写入
+SETTINGS_SAVE_DEBOUNCE_SECONDS = 0.5
+# 归档报告面板中最多展示的详情条数
+MAX_EMBED_DETAILS = 10
+# 归档成功明细的日志行模板，字段顺序与 AuditRunStats.log_archived_info_records 中的记录一致
+ARCHIVED_INFO_LINE_TEMPLATE = "\n  - [{}] {} | {} | 最后活跃时间: {} ({})"
+# 刷新记录文件 (JSONL) 的总行数超过有效记录数的该倍数时，启动时进行压缩
+BUMP_RECORDS_COMPACT_RATIO = 4
 
 # 加载环境变量
 from dotenv import load_dotenv
@@ -24,7 +53,11 @@ load_dotenv()
 
 # --- 日志配置 ---
 def setup_logging():
-    """配置日志记录器"""
+    """
+    配置日志记录器
+    日志记录先放入队列，由 QueueListener 在后台线程中写入文件和控制台，避免磁盘写入阻塞事件循环
+    返回 (机器人日志记录器, 队列监听器)，关闭程序前需调用监听器的 stop() 写出剩余日志
+    """
     LOG_DIRECTORY.mkdir(exist_ok=True)
     logger = logging.getLogger('discord')
     logger.setLevel(logging.INFO)
@@ -36,67 +69,95 @@ def setup_logging():
     formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s')
     handler.setFormatter(formatter)
 
-    logger.addHandler(handler)
-    bot_logger.addHandler(handler)
-
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
-    bot_logger.addHandler(stream_handler)
-    logger.addHandler(stream_handler)
 
-    return bot_logger
-
-bot_log = setup_logging()
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    bot_logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, handler, stream_handler)
+    listener.start()
+
+    return bot_logger, listener
+
+bot_log, log_listener = setup_logging()
+
+# --- 工具函数 ---
+def _read_json(path: Path):
+    """读取并解析 JSON 文件（同步，供 asyncio.to_thread 调用）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    """原子写入文本文件：先写入同目录临时文件，再通过 os.replace 替换目标文件"""
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _atomic_write_json(path: Path, data, compact: bool = False) -> None:
+    """原子写入 JSON 文件；compact 为 True 时不缩进，用于仅由程序读取的数据文件"""
+    if compact:
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    else:
+        text = json.dumps(data, ensure_ascii=False, indent=4)
+    _atomic_write_text(path, text)
+
+def _join_limited(parts: list[str], limit: int) -> str:
+    """拼接字符串片段，只取总长度达到 limit 所需的前若干个片段，结果截断为 limit 个字符"""
+    selected = []
+    total_length = 0
+    for part in parts:
+        selected.append(part)
+        total_length += len(part)
+        if total_length >= limit:
+            break
+    return "".join(selected)[:limit]
+
+def _append_text(path: Path, text: str) -> None:
+    """以追加模式写入文本"""
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
 
 # --- 自定义数据类 ---
+@dataclass(slots=True)
 class GuildArchiveSettings:
     """封装单个服务器的归档设置（黑名单模式）"""
-    def __init__(
-        self,
-        guild_id: int,
-        config_name: str,
-        blacklist_channel_ids: list[int],
-        archive_category_id: int | None,
-        inactivity_days: int,
-        notification_thread_id: int | None,
-        max_active_posts: int,
-        max_active_threads: int,
-        last_notice_message_id: int | None = None,
-        pinned_thread_moderation: dict | None = None,
-    ):
-        self.guild_id = guild_id
-        self.config_name = config_name
-        # 黑名单频道：这些频道中的帖子计入活跃总数，但不会被自动归档
-        self.blacklist_channel_ids = blacklist_channel_ids or []
-        self.archive_category_id = archive_category_id
-        self.inactivity_days = inactivity_days
-        self.notification_thread_id = notification_thread_id
-        self.max_active_posts = max_active_posts
-        self.max_active_threads = max_active_threads
-        self.last_notice_message_id = last_notice_message_id
+    guild_id: int
+    config_name: str
+    # 黑名单频道：这些频道中的帖子计入活跃总数，但不会被自动归档
+    blacklist_channel_ids: list[int]
+    archive_category_id: int | None
+    inactivity_days: int
+    notification_thread_id: int | None
+    max_active_posts: int
+    max_active_threads: int
+    last_notice_message_id: int | None = None
+    pinned_thread_moderation: InitVar[dict | None] = None
+
+    # 以下字段由 __post_init__ 根据上面的配置派生，修改对应配置（如 blacklist_channel_ids）后需同步重建
+    blacklist_channel_ids_set: frozenset[int] = field(init=False)
+    pinned_mod_enabled: bool = field(init=False)
+    # 豁免名单在每条置顶帖消息上都会被查询，使用 frozenset 以获得 O(1) 的成员判断
+    allowed_role_ids: frozenset[int] = field(init=False)
+    allowed_user_ids: frozenset[int] = field(init=False)
+    # 查看配置命令渲染出的 embed (Embed.to_dict())，配置修改后置为 None 重新生成
+    _cached_embed_dict: dict | None = field(init=False, default=None, repr=False, compare=False)
+
+    def __post_init__(self, pinned_thread_moderation: dict | None):
+        self.blacklist_channel_ids = self.blacklist_channel_ids or []
+        self.blacklist_channel_ids_set = frozenset(self.blacklist_channel_ids)
 
         mod_settings = pinned_thread_moderation or {}
         self.pinned_mod_enabled = mod_settings.get("enabled", False)
-        self.allowed_role_ids = [int(role_id) for role_id in mod_settings.get("allowed_role_ids", [])]
-        self.allowed_user_ids = [int(user_id) for user_id in mod_settings.get("allowed_user_ids", [])]
-
-    def to_dict(self) -> dict:
-        """将设置转换为字典以便保存到JSON"""
-        return {
-            "guild_id": self.guild_id,
-            "blacklist_channel_ids": self.blacklist_channel_ids,
-            "archive_category_id": self.archive_category_id,
-            "inactivity_days": self.inactivity_days,
-            "notification_thread_id": self.notification_thread_id,
-            "max_active_posts": self.max_active_posts,
-            "max_active_threads": self.max_active_threads,
-            "last_notice_message_id": self.last_notice_message_id,
-            "pinned_thread_moderation": {
-                "enabled": self.pinned_mod_enabled,
-                "allowed_role_ids": [str(role_id) for role_id in self.allowed_role_ids],
-                "allowed_user_ids": [str(user_id) for user_id in self.allowed_user_ids],
-            },
-        }
+        self.allowed_role_ids = frozenset(int(role_id) for role_id in mod_settings.get("allowed_role_ids", []))
+        self.allowed_user_ids = frozenset(int(user_id) for user_id in mod_settings.get("allowed_user_ids", []))
+
+    def to_runtime_state(self) -> dict:
+        """只导出可在运行时修改的字段 (GUILD_RUNTIME_STATE_KEYS)，用于保存到 data/guilds/{config_name}.json"""
+        return {key: getattr(self, key) for key in GUILD_RUNTIME_STATE_KEYS}
 
     @classmethod
     def from_dict(cls, guild_id: int, config_name: str, data: dict) -> 'GuildArchiveSettings':
@@ -118,17 +179,106 @@ class ErrorMessage:
     """
     自定义对象: 模拟 discord.Message 对象, 仅包含 created_at 属性
     """
+    __slots__ = ('created_at',)
+
     def __init__(self, created_at: datetime): 
         self.created_at = created_at 
 
 class ThreadMessage: 
     """
     自定义对象: 储存帖子对象 thread 和最后一条消息对象 last_message
+    last_message 可能是完整的 discord.Message，也可能是仅由消息ID构造的 discord.Object (同样提供 created_at)
     """
-    def __init__(self, thread: discord.Thread, last_message: discord.Message | ErrorMessage):
+    __slots__ = ('thread', 'last_message')
+
+    def __init__(self, thread: discord.Thread, last_message: discord.Message | discord.Object | ErrorMessage):
         self.thread = thread
         self.last_message = last_message
 
+class ArchiveResult:
+    """
+    自定义对象: 单个帖子的归档结果
+    error 为 None 表示归档成功，否则为归档时发生的异常
+    """
+    __slots__ = ('thread', 'last_message_time_str', 'hours_diff_str', 'days_diff_str', 'error')
+
+    def __init__(self, thread: discord.Thread, last_message_time_str: str, hours_diff_str: str, days_diff_str: str, error: Exception | None = None):
+        self.thread = thread
+        self.last_message_time_str = last_message_time_str
+        self.hours_diff_str = hours_diff_str
+        self.days_diff_str = days_diff_str
+        self.error = error
+
+class AuditRunStats:
+    """
+    自定义对象: 单次服务器审计的统计数据与日志明细
+    每次 process_guild_threads 调用各自持有一份，使多个服务器的审计可以并发执行
+    """
+    def __init__(self):
+        self.succeed_count = 0
+        self.fail_count = 0
+        self.message_succeed_count = 0
+        self.not_found_error_count = 0
+        # 明细日志按行收集，输出报告时再一次性拼接
+        self.log_get_message_error_details: list[str] = []
+        # 归档成功明细以 (序号, 帖子名, 帖子ID, 最后活跃时间, 距今时长) 记录，输出报告时再格式化
+        self.log_archived_info_records: list[tuple[int, str, int, str, str]] = []
+        self.log_archived_error_details: list[str] = []
+        # 报告面板中展示的详情，最多保留 MAX_EMBED_DETAILS 条
+        self.archive_run_details_for_embed: dict[str, str] = {}
+        self.embed_details_full = False
+
+    def add_embed_detail(self, title: str, desc: str):
+        """添加一条面板详情，达到上限后忽略"""
+        if self.embed_details_full:
+            return
+        self.archive_run_details_for_embed[title] = desc
+        self.embed_details_full = len(self.archive_run_details_for_embed) >= MAX_EMBED_DETAILS
+
+    def add_archive_result(self, result: ArchiveResult):
+        """汇总单个帖子的归档结果：更新计数、记录日志明细与面板详情"""
+        thread = result.thread
+        e = result.error
+        if e is None:
+            self.succeed_count += 1
+            self.log_archived_info_records.append((self.succeed_count, thread.name, thread.id, result.last_message_time_str, result.hours_diff_str))
+
+            # 面板详情已满时不再构造详情字符串
+            if not self.embed_details_full:
+                embed_title_key = f"[T{self.succeed_count}] 归档成功↓"
+                embed_value_desc = f"> {thread.mention}\n> 最后活跃时间: {result.last_message_time_str} ({result.days_diff_str})"
+                self.add_embed_detail(embed_title_key, embed_value_desc)
+        else:
+            self.fail_count += 1
+            log_line = f"\n  - [E{self.fail_count}] {thread.name} (ID:{thread.id}) | 最后一条消息: {result.last_message_time_str} ({result.hours_diff_str}) | 错误: {e}"
+            self.log_archived_error_details.append(log_line)
+
+            if not self.embed_details_full:
+                embed_title_key = f"[E{self.fail_count}] 归档失败"
+                embed_value_desc = f"- ID:{thread.id} {thread.mention}\n- 最后一条消息: {result.last_message_time_str} ({result.hours_diff_str})\n- 错误: {str(e)[:100]}"
+                self.add_embed_detail(embed_title_key, embed_value_desc)
+
+class TokenBucket:
+    """
+    自定义对象: 简单的异步令牌桶限速器
+    允许最多 capacity 次突发操作，之后每 refill_seconds 秒恢复一个令牌，仅在令牌耗尽时等待
+    """
+    def __init__(self, capacity: int, refill_seconds: float):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) / self.refill_seconds)
+        self.updated_at = now
+        if self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) * self.refill_seconds)
+            self.tokens = 1.0
+            self.updated_at = time.monotonic()
+        self.tokens -= 1
+
 # --- 机器人核心类 ---
 class ThreadArchiverBot(commands.Bot):
     def __init__(self):
@@ -139,32 +289,40 @@ class ThreadArchiverBot(commands.Bot):
 
         super().__init__(command_prefix=commands.when_mentioned_or("!archiver "), intents=intents)
 
-        self.global_config = {}
         self.guild_settings_map: dict[int, GuildArchiveSettings] = {}
+        # 配置名 -> (服务器ID, 配置) 的索引，随 guild_settings_map 一起维护
+        self.config_name_index: dict[str, tuple[int, GuildArchiveSettings]] = {}
+        # 启用了置顶帖消息管理的服务器ID，on_message 据此快速过滤，pinned_mod_enabled 变化时需同步更新
+        self._pinned_mod_enabled_guilds: set[int] = set()
+        # 待保存的服务器配置，由 mark_dirty 合并后延迟写入
+        self._dirty_guild_ids: set[int] = set()
+        self._save_task: asyncio.Task | None = None
+        # 延迟保存任务正在写入（而非等待）时为 True，此时关闭程序需等待其完成而不能取消
+        self._save_task_flushing = False
         self.bot_token = None
         self.operation_lock = asyncio.Lock()
+        # 限制所有服务器审计中同时进行的 HTTP 请求数，避免触发速率限制
+        self.http_sem = asyncio.Semaphore(HTTP_CONCURRENCY)
+        # 归档请求间隔，根据是否遇到速率限制 (429) 自适应调整
+        self._archive_delay: float = ARCHIVE_DELAY_INITIAL
 
         DATA_DIRECTORY.mkdir(exist_ok=True)
+        GUILD_STATE_DIRECTORY.mkdir(exist_ok=True)
         
-        self.BUMP_RECORDS_FILE = DATA_DIRECTORY / "pinned_thread_bump_records.json"
+        # 刷新记录以 JSONL 追加写入，每行一条 {"id": 帖子ID, "ts": 刷新时间}，同一帖子以最后一行为准
+        self.BUMP_RECORDS_FILE = DATA_DIRECTORY / "pinned_thread_bump_records.jsonl"
+        self.LEGACY_BUMP_RECORDS_FILE = DATA_DIRECTORY / "pinned_thread_bump_records.json"
         self.bump_records: dict[int, dict] = {}
         self.bump_records_lock = asyncio.Lock()
+        # 尚未写盘的刷新记录（帖子ID），审计结束（或关闭）时统一追加写入一次
+        self._pending_bump_ids: set[int] = set()
 
         self.PINNED_MESSAGES_FILE = DATA_DIRECTORY / "pinned_thread_last_messages.json"
         self.pinned_last_messages: dict[int, int] = {}
         self.pinned_messages_lock = asyncio.Lock()
 
-        self.succeed_count = 0
-        self.fail_count = 0
-        self.message_succeed_count = 0
-        self.not_found_error_count = 0
-        self.log_get_message_error_details = ""
-        self.log_archived_info_details = ""
-        self.log_archived_error_details = ""
-        self.archive_run_details_for_embed = {}
-
     async def load_configuration(self):
-        """加载配置（从环境变量 GUILD_CONFIGS_JSON）"""
+        """加载配置（从环境变量 GUILD_CONFIGS_JSON，并合并 data/guilds/{config_name}.json 中保存的运行时状态）"""
         self.bot_token = os.environ.get("BOT_TOKEN")
 
         if not self.bot_token:
@@ -182,29 +340,33 @@ class ThreadArchiverBot(commands.Bot):
             if not isinstance(guild_configurations, dict):
                 raise ValueError("GUILD_CONFIGS_JSON 必须是一个 JSON 对象，其键为服务器配置名。")
 
-            # 为兼容原有结构，仍然保留 self.global_config["guild_configurations"]
-            self.global_config = {"guild_configurations": guild_configurations}
-
             for config_name, settings_data in guild_configurations.items():
+                # 运行时修改过的字段保存在 data/guilds/{config_name}.json，只覆盖这些字段在环境变量中的初始值
+                config_file = GUILD_STATE_DIRECTORY / f"{config_name}.json"
+                try:
+                    runtime_state = await asyncio.to_thread(_read_json, config_file)
+                    settings_data.update({key: runtime_state[key] for key in GUILD_RUNTIME_STATE_KEYS if key in runtime_state})
+                except FileNotFoundError:
+                    pass
+                except (json.JSONDecodeError, OSError) as e:
+                    bot_log.warning(f"无法解析 {config_file}，将使用环境变量中的配置: {e}")
+
                 guild_id = settings_data.get("guild_id")
 
                 if not guild_id:
                     bot_log.warning(f"配置项 '{config_name}' 缺少 'guild_id'，已跳过。")
                     continue
 
-                notice_id_file = DATA_DIRECTORY / f"{config_name}_notice_id.txt"
-                last_notice_id = None
-
-                if notice_id_file.exists():
-                    try:
-                        last_notice_id = int(notice_id_file.read_text().strip())
-                    except ValueError:
-                        bot_log.warning(f"无法解析 {notice_id_file} 中的消息ID。")
-
-                settings_data["last_notice_message_id"] = last_notice_id
+                # 每个服务器只能对应一个配置，否则 config_name_index 中会残留不再生效的旧配置
+                if guild_id in self.guild_settings_map:
+                    bot_log.warning(f"配置项 '{config_name}' 的 guild_id {guild_id} 已被 '{self.guild_settings_map[guild_id].config_name}' 使用，已跳过。")
+                    continue
 
                 guild_setting = GuildArchiveSettings.from_dict(guild_id, config_name, settings_data)
                 self.guild_settings_map[guild_id] = guild_setting
+                self.config_name_index[config_name] = (guild_id, guild_setting)
+                if guild_setting.pinned_mod_enabled:
+                    self._pinned_mod_enabled_guilds.add(guild_id)
                 bot_log.info(f"已加载服务器 '{config_name}' (ID: {guild_id}) 的配置。")
 
         except json.JSONDecodeError:
@@ -215,125 +377,157 @@ class ThreadArchiverBot(commands.Bot):
             sys.exit(1)
 
     async def save_guild_setting(self, guild_id: int):
-        """保存单个服务器的配置（写回 .env 中的 GUILD_CONFIGS_JSON，并更新本地通知ID文件）"""
+        """保存单个服务器的运行时状态（原子写入 data/guilds/{config_name}.json，包含最后通知消息ID）"""
         if guild_id not in self.guild_settings_map:
             bot_log.error(f"尝试保存未知的服务器配置: {guild_id}")
             return
 
         setting = self.guild_settings_map[guild_id]
+        setting._cached_embed_dict = None
+        config_file = GUILD_STATE_DIRECTORY / f"{setting.config_name}.json"
         try:
-            self._save_guild_configs_to_env()
-            bot_log.info(".env 中的 GUILD_CONFIGS_JSON 已更新。")
+            await asyncio.to_thread(_atomic_write_json, config_file, setting.to_runtime_state())
+            bot_log.info(f"已保存 {setting.config_name} 的配置到 {config_file}")
         except Exception as e:
-            bot_log.error(f"写入 .env 中的 GUILD_CONFIGS_JSON 失败: {e}", exc_info=True)
-
-        if setting.last_notice_message_id is not None:
-            notice_id_file = DATA_DIRECTORY / f"{setting.config_name}_notice_id.txt"
+            bot_log.error(f"写入 {config_file} 失败: {e}", exc_info=True)
+
+    def resolve_config(self, config_name: str) -> tuple[int, GuildArchiveSettings] | None:
+        """按配置名查找服务器配置，返回 (服务器ID, 配置)，未找到时返回 None"""
+        return self.config_name_index.get(config_name)
+
+    def mark_dirty(self, guild_id: int):
+        """标记服务器配置待保存，短时间内的多次修改合并为一次写入"""
+        self._dirty_guild_ids.add(guild_id)
+        setting = self.guild_settings_map.get(guild_id)
+        if setting:
+            setting._cached_embed_dict = None
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._flush_dirty_settings_after(SETTINGS_SAVE_DEBOUNCE_SECONDS))
+
+    async def _flush_dirty_settings_after(self, delay: float):
+        # 写入期间 mark_dirty 不会新建任务，因此循环直到没有待保存的配置
+        while self._dirty_guild_ids:
+            await asyncio.sleep(delay)
+            self._save_task_flushing = True
             try:
-                notice_id_file.write_text(str(setting.last_notice_message_id))
-                bot_log.info(f"已更新 {setting.config_name} 的通知消息ID到 {notice_id_file}")
-            except Exception as e:
-                bot_log.error(f"写入 {notice_id_file} 失败: {e}", exc_info=True)
-
-    def _save_guild_configs_to_env(self):
-        """将当前内存中的服务器配置写回到 .env 的 GUILD_CONFIGS_JSON 变量"""
-        # 先从 GuildArchiveSettings 对象重建配置字典，确保与运行时状态一致
-        guild_configurations: dict[str, dict] = {}
-        for setting in self.guild_settings_map.values():
-            guild_configurations[setting.config_name] = setting.to_dict()
-
-        self.global_config = {"guild_configurations": guild_configurations}
-
-        new_json_str = json.dumps(guild_configurations, ensure_ascii=False)
-
-        env_path = Path(".env")
-        existing_content = ""
-        if env_path.exists():
-            existing_content = env_path.read_text(encoding="utf-8")
-
-        lines = existing_content.splitlines() if existing_content else []
-        new_line = f"GUILD_CONFIGS_JSON={new_json_str}"
-
-        updated = False
-        for idx, line in enumerate(lines):
-            stripped = line.strip()
-            if stripped.startswith("GUILD_CONFIGS_JSON="):
-                lines[idx] = new_line
-                updated = True
-                break
-
-        if not updated:
-            if lines and lines[-1].strip() != "":
-                lines.append("")
-            lines.append(new_line)
-
-        if lines:
-            new_content = "\n".join(lines) + "\n"
-        else:
-            new_content = new_line + "\n"
+                await self._flush_dirty_settings()
+            finally:
+                self._save_task_flushing = False
 
-        env_path.write_text(new_content, encoding="utf-8")
-    
-    
-    def _load_bump_records(self):
-        """同步加载刷新记录文件到内存"""
+    async def _flush_dirty_settings(self):
+        """写入所有待保存的服务器配置，中途失败或被取消时未写入的配置重新放回待保存集合"""
+        pending_guild_ids, self._dirty_guild_ids = self._dirty_guild_ids, set()
         try:
+            while pending_guild_ids:
+                guild_id = next(iter(pending_guild_ids))
+                await self.save_guild_setting(guild_id)
+                pending_guild_ids.discard(guild_id)
+        finally:
+            self._dirty_guild_ids |= pending_guild_ids
+
+    async def _load_bump_records(self):
+        """在工作线程中读取并解析刷新记录文件，避免阻塞事件循环"""
+        def _read_records() -> tuple[dict[int, dict], int]:
+            records: dict[int, dict] = {}
+            line_count = 0
             with open(self.BUMP_RECORDS_FILE, 'r', encoding='utf-8') as f:
-                records_from_file = json.load(f)
-                # 将ISO格式的时间字符串转换回datetime对象
-                for thread_id, data in records_from_file.items():
-                    self.bump_records[int(thread_id)] = {
-                        "last_bumped_utc": datetime.fromisoformat(data["last_bumped_utc"])
-                    }
-                bot_log.info(f"成功从 {self.BUMP_RECORDS_FILE} 加载了 {len(self.bump_records)} 条置顶帖刷新记录。")
-        except FileNotFoundError:
-            bot_log.info(f"刷新记录文件 {self.BUMP_RECORDS_FILE} 未找到，将创建一个新的。")
-        except (json.JSONDecodeError, KeyError, TypeError) as e:
-            bot_log.error(f"加载刷新记录文件失败，文件可能已损坏: {e}", exc_info=True)
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    line_count += 1
+                    try:
+                        entry = json.loads(line)
+                        records[int(entry["id"])] = {"last_bumped_utc": datetime.fromisoformat(entry["ts"])}
+                    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                        # 跳过写入中断等原因造成的损坏行
+                        continue
+            return records, line_count
+
+        def _read_legacy_records() -> dict[int, dict]:
+            records_from_file = _read_json(self.LEGACY_BUMP_RECORDS_FILE)
+            # 将ISO格式的时间字符串转换回datetime对象
+            return {
+                int(thread_id): {"last_bumped_utc": datetime.fromisoformat(data["last_bumped_utc"])}
+                for thread_id, data in records_from_file.items()
+            }
 
-    def _load_pinned_last_messages(self):
-        """同步加载置顶帖最后消息ID记录"""
         try:
-            with open(self.PINNED_MESSAGES_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.pinned_last_messages = {int(k): int(v) for k, v in data.items()}
-                bot_log.info(f"成功加载了 {len(self.pinned_last_messages)} 条置顶帖消息记录。")
+            self.bump_records, line_count = await asyncio.to_thread(_read_records)
+            bot_log.info(f"成功从 {self.BUMP_RECORDS_FILE} 加载了 {len(self.bump_records)} 条置顶帖刷新记录。")
+            if line_count > BUMP_RECORDS_COMPACT_RATIO * max(len(self.bump_records), 1):
+                await self._compact_bump_records()
+        except FileNotFoundError:
+            try:
+                # 迁移旧版本的 JSON 格式记录
+                self.bump_records = await asyncio.to_thread(_read_legacy_records)
+                bot_log.info(f"已从旧版记录文件 {self.LEGACY_BUMP_RECORDS_FILE} 迁移 {len(self.bump_records)} 条置顶帖刷新记录。")
+                await self._compact_bump_records()
+            except FileNotFoundError:
+                bot_log.info(f"刷新记录文件 {self.BUMP_RECORDS_FILE} 未找到，将创建一个新的。")
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                bot_log.error(f"加载旧版刷新记录文件失败，文件可能已损坏: {e}", exc_info=True)
+        except OSError as e:
+            bot_log.error(f"加载刷新记录文件失败: {e}", exc_info=True)
+
+    async def _load_pinned_last_messages(self):
+        """在工作线程中加载置顶帖最后消息ID记录"""
+        try:
+            data = await asyncio.to_thread(_read_json, self.PINNED_MESSAGES_FILE)
+            self.pinned_last_messages = {int(k): int(v) for k, v in data.items()}
+            bot_log.info(f"成功加载了 {len(self.pinned_last_messages)} 条置顶帖消息记录。")
         except FileNotFoundError:
             bot_log.info(f"置顶帖消息记录文件未找到，将创建新的。")
         except Exception as e:
             bot_log.error(f"加载置顶帖消息记录失败: {e}", exc_info=True)
 
     async def _save_pinned_last_messages(self):
-        """保存置顶帖最后消息ID记录到文件"""
+        """在工作线程中原子写入置顶帖最后消息ID记录"""
         async with self.pinned_messages_lock:
             try:
                 data = {str(k): v for k, v in self.pinned_last_messages.items()}
-                with open(self.PINNED_MESSAGES_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=4)
+                await asyncio.to_thread(_atomic_write_json, self.PINNED_MESSAGES_FILE, data, True)
             except Exception as e:
                 bot_log.error(f"保存置顶帖消息记录失败: {e}", exc_info=True)
 
+    @staticmethod
+    def _format_bump_record(thread_id: int, last_bumped_utc: datetime) -> str:
+        return json.dumps({"id": thread_id, "ts": last_bumped_utc.isoformat()}, separators=(',', ':')) + "\n"
+
     async def _save_bump_records(self):
-        """将内存中的刷新记录保存到文件"""
+        """将新增的刷新记录追加写入文件，写入量只与新增记录数成正比"""
         async with self.bump_records_lock:
+            pending_ids, self._pending_bump_ids = self._pending_bump_ids, set()
+            if not pending_ids:
+                return
             try:
-                # 准备要写入的数据，将datetime对象转换为ISO格式的字符串
-                records_to_save = {}
-                for thread_id, data in self.bump_records.items():
-                    records_to_save[str(thread_id)] = {
-                        "last_bumped_utc": data["last_bumped_utc"].isoformat()
-                    }
-                
-                with open(self.BUMP_RECORDS_FILE, 'w', encoding='utf-8') as f:
-                    json.dump(records_to_save, f, indent=4)
+                lines = "".join(
+                    self._format_bump_record(thread_id, self.bump_records[thread_id]["last_bumped_utc"])
+                    for thread_id in pending_ids
+                )
+                await asyncio.to_thread(_append_text, self.BUMP_RECORDS_FILE, lines)
             except Exception as e:
+                # 写入失败时保留待写记录，下次再尝试
+                self._pending_bump_ids |= pending_ids
                 bot_log.error(f"保存刷新记录到 {self.BUMP_RECORDS_FILE} 失败: {e}", exc_info=True)
-    
-    
+
+    async def _compact_bump_records(self):
+        """用内存中的有效记录原子重写刷新记录文件，去除重复行"""
+        async with self.bump_records_lock:
+            try:
+                content = "".join(
+                    self._format_bump_record(thread_id, data["last_bumped_utc"])
+                    for thread_id, data in self.bump_records.items()
+                )
+                await asyncio.to_thread(_atomic_write_text, self.BUMP_RECORDS_FILE, content)
+                bot_log.info(f"已压缩刷新记录文件 {self.BUMP_RECORDS_FILE}，保留 {len(self.bump_records)} 条记录。")
+            except Exception as e:
+                bot_log.error(f"压缩刷新记录文件 {self.BUMP_RECORDS_FILE} 失败: {e}", exc_info=True)
+
     async def setup_hook(self):
         """Bot启动时的异步设置"""
-        self._load_bump_records()
-        self._load_pinned_last_messages()
+        await self._load_bump_records()
+        await self._load_pinned_last_messages()
         await self.load_configuration()
         await self.add_cog(ArchiveManagerCog(self))
     
@@ -345,30 +539,46 @@ class ThreadArchiverBot(commands.Bot):
 
         self.periodic_thread_audit.start()
 
+    async def close(self):
+        """关闭前写入尚未保存的服务器配置与刷新记录"""
+        if self._save_task and not self._save_task.done():
+            # 仍在等待中的任务直接取消；正在写入的任务需等待其完成，避免与下面的写入同时操作同一文件
+            if not self._save_task_flushing:
+                self._save_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._save_task
+        if self._dirty_guild_ids:
+            await self._flush_dirty_settings()
+        if self._pending_bump_ids:
+            await self._save_bump_records()
+        await super().close()
+
     def _is_user_exempt(self, author: discord.Member | discord.User, thread: discord.Thread, settings: GuildArchiveSettings) -> bool:
         """
         检查用户是否在置顶帖中拥有消息豁免权。
         返回 True 表示用户豁免，不应删除其消息。
         """
 
+        # 按开销从低到高依次检查
         # 帖主 豁免
         if thread.owner_id and author.id == thread.owner_id:
             return True
 
-        # 只有 discord.Member 对象才有权限和角色信息，需要进行类型检查
-        if isinstance(author, discord.Member):
-            # 服务器管理员 (Administrator) 豁免
-            if author.guild_permissions.administrator:
-                return True
-            
-            # 在配置中的豁免角色组ID (allowed_role_ids)
-            author_role_ids = {role.id for role in author.roles}
-            if not author_role_ids.isdisjoint(settings.allowed_role_ids):
-                return True
-
         # 在配置中的豁免用户ID (allowed_user_ids)
         if author.id in settings.allowed_user_ids:
             return True
+
+        # 只有 discord.Member 对象才有权限和角色信息，需要进行类型检查
+        if not isinstance(author, discord.Member):
+            return False
+
+        # 在配置中的豁免角色组ID (allowed_role_ids)，Member.get_role 直接查询成员的角色ID列表，无需构造 author.roles
+        if any(author.get_role(role_id) is not None for role_id in settings.allowed_role_ids):
+            return True
+
+        # 服务器管理员 (Administrator) 豁免
+        if author.guild_permissions.administrator:
+            return True
         
         # 如果以上规则都不满足，则用户不豁免
         return False
@@ -405,6 +615,11 @@ class ThreadArchiverBot(commands.Bot):
         if message.author.bot or not message.guild:
             return
 
+        # 未配置或未启用置顶帖消息管理的服务器直接忽略（一次集合查询）
+        if message.guild.id not in self._pinned_mod_enabled_guilds:
+            return
+        settings = self.guild_settings_map[message.guild.id]
+
         # 检查消息是否在帖子(Thread)中
         if not isinstance(message.channel, discord.Thread):
             return
@@ -415,11 +630,6 @@ class ThreadArchiverBot(commands.Bot):
         if not thread.flags.pinned:
             return
 
-        # 获取当前服务器的配置
-        settings = self.guild_settings_map.get(message.guild.id)
-        if not settings or not settings.pinned_mod_enabled:
-            return # 如果没有配置或功能未启用，则不做任何事
-
         # 检查用户是否在豁免名单中
         author = message.author
         
@@ -445,18 +655,30 @@ class ThreadArchiverBot(commands.Bot):
         if not self.guild_settings_map:
             return
 
+        # 各服务器的速率限制相互独立，并发审计多个服务器，同时限制并发数量
+        sem = asyncio.Semaphore(GUILD_AUDIT_CONCURRENCY)
+
+        async def _audit_one(guild: Guild, settings: GuildArchiveSettings):
+            async with sem:
+                bot_log.info(f"正在审计服务器: '{guild.name}' (ID: {guild.id})")
+                try:
+                    await self.process_guild_threads(guild, settings, manual=False)
+                except Exception as e:
+                    bot_log.error(f"审计服务器 '{guild.name}' (ID: {guild.id}) 时发生错误: {e}", exc_info=True)
+
         async with self.operation_lock:
             bot_log.info("开始执行周期性帖子审计...")
-            for guild_id, settings in self.guild_settings_map.items():
-                guild = self.get_guild(guild_id)
+            audit_tasks = []
+            for settings in self.guild_settings_map.values():
+                guild = self.get_guild(settings.guild_id)
 
                 if not guild:
-                    bot_log.warning(f"审计：找不到服务器 {guild_id}，跳过。")
+                    bot_log.warning(f"审计：找不到服务器 {settings.guild_id}，跳过。")
                     continue
 
-                bot_log.info(f"正在审计服务器: '{guild.name}' (ID: {guild_id})")
-                await self.process_guild_threads(guild, settings, manual=False)
-                await asyncio.sleep(10) 
+                audit_tasks.append(_audit_one(guild, settings))
+
+            await asyncio.gather(*audit_tasks)
             bot_log.info("周期性帖子审计完成。")
 
     @periodic_thread_audit.before_loop
@@ -466,44 +688,39 @@ class ThreadArchiverBot(commands.Bot):
 
     async def process_guild_threads(self, guild: Guild, settings: GuildArchiveSettings, manual: bool = False):
 
-        now_utc_timestamp = time.time()
-        current_run_timestamp_str = datetime.fromtimestamp(now_utc_timestamp, tz=timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S UTC+8')
-        hash_input = str(now_utc_timestamp)
-        run_hash_value = hashlib.md5(hash_input.encode()).hexdigest()[:8]
+        # 本次审计统一使用的当前时间
+        now_utc = datetime.now(timezone.utc)
+        now_utc_timestamp = now_utc.timestamp()
+        current_run_timestamp_str = time.strftime('%Y-%m-%d %H:%M:%S UTC+8', time.gmtime(now_utc_timestamp + 8 * 3600))
+        run_hash_value = secrets.token_hex(4)
 
-        self.succeed_count = 0
-        self.fail_count = 0
-        self.message_succeed_count = 0
-        self.not_found_error_count = 0
-        self.log_get_message_error_details = ""
-        self.log_archived_info_details = ""
-        self.log_archived_error_details = ""
-        self.archive_run_details_for_embed = {}
+        stats = AuditRunStats()
 
-        initial_log_info = ""
-        overall_summary_embed_description = ""
-        global_start_time = time.time()
-        overall_summary_embed_description += f"> 不活跃 **{settings.inactivity_days}** 天归档：**{'开启' if settings.inactivity_days > 0 else '关闭'}**\n"
-        initial_log_info += f"> 不活跃 **{settings.inactivity_days}** 天归档: {'开启' if settings.inactivity_days > 0 else '关闭'}\n"
+        # 日志与面板描述先收集为片段列表，最后一次性拼接
+        run_log_parts: list[str] = []
+        summary_embed_parts: list[str] = []
+        global_start_time = now_utc_timestamp
+        summary_embed_parts.append(f"> 不活跃 **{settings.inactivity_days}** 天归档：**{'开启' if settings.inactivity_days > 0 else '关闭'}**\n")
+        run_log_parts.append(f"> 不活跃 **{settings.inactivity_days}** 天归档: {'开启' if settings.inactivity_days > 0 else '关闭'}\n")
 
         blacklist_count = len(settings.blacklist_channel_ids)
         if blacklist_count > 0:
-            overall_summary_embed_description += f"> 黑名单频道数: **{blacklist_count}**（这些频道中的帖子不会被自动归档）\n"
-            initial_log_info += f"已配置 {blacklist_count} 个黑名单频道，这些频道中的帖子不会被自动归档。\n"
+            summary_embed_parts.append(f"> 黑名单频道数: **{blacklist_count}**（这些频道中的帖子不会被自动归档）\n")
+            run_log_parts.append(f"已配置 {blacklist_count} 个黑名单频道，这些频道中的帖子不会被自动归档。\n")
         else:
-            overall_summary_embed_description += f"> 未配置黑名单频道，默认对所有频道执行归档策略\n"
-            initial_log_info += "未配置黑名单频道，将对所有频道执行归档策略。\n"
+            summary_embed_parts.append(f"> 未配置黑名单频道，默认对所有频道执行归档策略\n")
+            run_log_parts.append("未配置黑名单频道，将对所有频道执行归档策略。\n")
 
-        overall_summary_embed_description += "\n"
+        summary_embed_parts.append("\n")
 
         if manual:
-            initial_log_info += f"\n<== 手动开始清理 (服务器级优先) ==> 服务器: {settings.config_name} ({guild.name}) | 日志索引: {run_hash_value}"
+            run_log_parts.append(f"\n<== 手动开始清理 (服务器级优先) ==> 服务器: {settings.config_name} ({guild.name}) | 日志索引: {run_hash_value}")
 
         else:
-            initial_log_info += f"\n<== 自动开始清理 (服务器级优先) ==> 服务器: {settings.config_name} ({guild.name}) | 日志索引: {run_hash_value}"
+            run_log_parts.append(f"\n<== 自动开始清理 (服务器级优先) ==> 服务器: {settings.config_name} ({guild.name}) | 日志索引: {run_hash_value}")
 
-        initial_log_info += f"\n服务器级活跃帖目标: {settings.max_active_threads}"
-        overall_summary_embed_description += f"> 服务器活跃帖目标: **{settings.max_active_threads}**\n"
+        run_log_parts.append(f"\n服务器级活跃帖目标: {settings.max_active_threads}")
+        summary_embed_parts.append(f"> 服务器活跃帖目标: **{settings.max_active_threads}**\n")
 
         # --- 步骤 1: 获取服务器所有活跃帖子 ---
         all_server_active_threads_list = []
@@ -514,247 +731,264 @@ class ThreadArchiverBot(commands.Bot):
 
         except Exception as e:
             bot_log.error(f"获取或筛选服务器 {guild.name} 活跃帖子失败: {e}", exc_info=True)
-            initial_log_info += f"\n错误：获取或筛选服务器活跃帖子失败: {e}"
+            run_log_parts.append(f"\n错误：获取或筛选服务器活跃帖子失败: {e}")
             return
 
         current_total_server_threads = len(all_server_active_threads_list)
-        overall_summary_embed_description += f"> 当前服务器总活跃帖: **{current_total_server_threads}**\n"
+        summary_embed_parts.append(f"> 当前服务器总活跃帖: **{current_total_server_threads}**\n")
+
+        # 单次遍历：分出置顶帖，以及可参与归档的候选帖（排除置顶、锁定及黑名单频道）
+        pinned_threads_list = []
+        archive_candidate_threads = []
+        for thread_obj in all_server_active_threads_list:
+            if thread_obj.flags.pinned:
+                pinned_threads_list.append(thread_obj)
+            elif not thread_obj.locked and thread_obj.parent_id not in settings.blacklist_channel_ids_set:
+                archive_candidate_threads.append(thread_obj)
+        pinned_threads_set_server_wide = {thread_obj.id for thread_obj in pinned_threads_list}
 
         # --- 步骤 2: 置顶帖处理 (全服务器范围) ---
-        pinned_threads_set_server_wide = set()
-        initial_log_info += f"\n置顶帖处理 (全服务器):"
-        now_utc = datetime.now(timezone.utc)
+        run_log_parts.append(f"\n置顶帖处理 (全服务器):")
         # 48 小时前的刷新操作已经可能失效
         self_trust_duration = timedelta(hours=48)
+        # 为防止API速率限制，保活操作经令牌桶限速，仅在短时间内连续保活过多时才等待
+        bump_limiter = TokenBucket(PINNED_BUMP_BURST, PINNED_BUMP_REFILL_SECONDS)
 
-        for thread_obj in all_server_active_threads_list:
-            if not thread_obj.flags.pinned:
-                continue # 只处理置顶帖
-
-            pinned_threads_set_server_wide.add(thread_obj.id)
-            
-            try:
-                # 如果帖子意外被归档，立即激活
-                if thread_obj.archived:
-                    await thread_obj.edit(archived=False, reason="[保活] 发现已归档的置顶帖，进行激活")
-                    initial_log_info += f"\n  [已取消置顶帖归档] {thread_obj.name} (ID: {thread_obj.id})"
-                    continue
+        try:
+            for thread_obj in pinned_threads_list:
+                try:
+                    # 如果帖子意外被归档，立即激活
+                    if thread_obj.archived:
+                        await thread_obj.edit(archived=False, reason="[保活] 发现已归档的置顶帖，进行激活")
+                        run_log_parts.append(f"\n  [已取消置顶帖归档] {thread_obj.name} (ID: {thread_obj.id})")
+                        continue
 
-                # 检查内存中的持久化记录
-                record = self.bump_records.get(thread_obj.id)
-                if record and (now_utc - record["last_bumped_utc"] < self_trust_duration):
-                    # 如果我们在48小时内刷新过它，就跳过它，不进行刷新
-                    continue
+                    # 检查内存中的持久化记录
+                    record = self.bump_records.get(thread_obj.id)
+                    if record and (now_utc - record["last_bumped_utc"] < self_trust_duration):
+                        # 如果我们在48小时内刷新过它，就跳过它，不进行刷新
+                        continue
 
-                # 执行保活操作
-                reason_for_bump = "记录不存在" if not record else "记录已过期"
-                initial_log_info += f"\n  [需要保活] {thread_obj.name} (原因: {reason_for_bump})。"
+                    # 执行保活操作
+                    reason_for_bump = "记录不存在" if not record else "记录已过期"
+                    run_log_parts.append(f"\n  [需要保活] {thread_obj.name} (原因: {reason_for_bump})。")
                 
-                action_taken = False
-                if not thread_obj.locked:
-                    temp_message = await thread_obj.send(f"置顶帖保活，稍后删除")
-                    await temp_message.delete()
-                    action_taken = True
-                    initial_log_info += f" -> 已通过消息刷新。"
-                else:
-                    await thread_obj.edit(locked=True, reason="[保活] 刷新锁定的置顶帖活跃度")
-                    action_taken = True
-                    initial_log_info += f" -> 已通过Edit刷新。"
+                    action_taken = False
+                    await bump_limiter.acquire()
+                    if not thread_obj.locked:
+                        # delete_after 由 discord.py 在后台删除消息，这里只需等待一次发送请求
+                        await thread_obj.send(f"置顶帖保活，稍后删除", delete_after=1)
+                        action_taken = True
+                        run_log_parts.append(f" -> 已通过消息刷新。")
+                    else:
+                        await thread_obj.edit(locked=True, reason="[保活] 刷新锁定的置顶帖活跃度")
+                        action_taken = True
+                        run_log_parts.append(f" -> 已通过Edit刷新。")
                 
-                # 更新内存记录并异步保存到文件
-                if action_taken:
-                    self.bump_records[thread_obj.id] = { "last_bumped_utc": now_utc }
-                    await self._save_bump_records()
-                    initial_log_info += f" 等待4秒..."
-                    await asyncio.sleep(4) # 为防止API速率限制，在每次成功刷新后等待
-
-            except Exception as e:
-                initial_log_info += f"\n  [保活失败] 处理 {thread_obj.name} 时发生未知错误: {e}"
+                    # 更新内存记录并异步保存到文件
+                    if action_taken:
+                        self.bump_records[thread_obj.id] = { "last_bumped_utc": now_utc }
+                        self._pending_bump_ids.add(thread_obj.id)
+
+                except Exception as e:
+                    run_log_parts.append(f"\n  [保活失败] 处理 {thread_obj.name} 时发生未知错误: {e}")
+        finally:
+            # 所有置顶帖处理完毕（或审计中途被取消）后统一写入一次刷新记录
+            if self._pending_bump_ids:
+                await self._save_bump_records()
 
         pinned_server_wide_count = len(pinned_threads_set_server_wide)
-        initial_log_info += f"\n全服务器置顶帖子数: **{pinned_server_wide_count}**"
-        overall_summary_embed_description += f"> 全服置顶帖: {pinned_server_wide_count}\n"
+        run_log_parts.append(f"\n全服务器置顶帖子数: **{pinned_server_wide_count}**")
+        summary_embed_parts.append(f"> 全服置顶帖: {pinned_server_wide_count}\n")
         
         # --- 置顶帖消息审计 ---
         if settings.pinned_mod_enabled and pinned_server_wide_count > 0:
-            audit_log = await self._audit_pinned_thread_messages(guild, settings, pinned_threads_set_server_wide)
-            initial_log_info += audit_log
+            audit_log = await self._audit_pinned_thread_messages(guild, settings, pinned_threads_set_server_wide, stats, now_utc)
+            run_log_parts.append(audit_log)
         
         # --- 步骤 3: 服务器级数量控制 ---
         kill_count_server_level = current_total_server_threads - settings.max_active_threads
-        initial_log_info += f"\n计算服务器级归档数: (总活跃 {current_total_server_threads}) - (目标 {settings.max_active_threads}) = {kill_count_server_level}"
+        run_log_parts.append(f"\n计算服务器级归档数: (总活跃 {current_total_server_threads}) - (目标 {settings.max_active_threads}) = {kill_count_server_level}")
 
         threads_archived_this_run = 0
+        # 本次审计内共享的最后消息缓存 (帖子ID -> 消息)
+        last_message_cache: dict[int, discord.Message | ErrorMessage] = {}
+        # 服务器级已处理过的帖子ID，不活跃检查阶段不再重复获取消息
+        server_level_processed_ids: set[int] = set()
 
         if kill_count_server_level > 0:
-            overall_summary_embed_description += f"> 服务器需归档数量: **{kill_count_server_level}**\n"
-            initial_log_info += f"\n服务器级需归档数量: {kill_count_server_level}。开始筛选候选帖子..."
-
-            candidate_threads_for_server_kill = []
+            summary_embed_parts.append(f"> 服务器需归档数量: **{kill_count_server_level}**\n")
+            run_log_parts.append(f"\n服务器级需归档数量: {kill_count_server_level}。开始筛选候选帖子...")
 
             # 黑名单频道内的帖子计入活跃总数，但不会作为归档候选
-            blacklisted_parent_ids_set = set(settings.blacklist_channel_ids)
+            candidate_threads_for_server_kill = archive_candidate_threads
 
-            for thread_obj in all_server_active_threads_list:
-                if (
-                    thread_obj.id not in pinned_threads_set_server_wide
-                    and not thread_obj.locked
-                    and thread_obj.parent_id not in blacklisted_parent_ids_set
-                ):
-                    candidate_threads_for_server_kill.append(thread_obj)
-
-            initial_log_info += f"\n  可用于服务器级归档的候选帖子数(排除置顶/锁定/黑名单频道): {len(candidate_threads_for_server_kill)}"
+            run_log_parts.append(f"\n  可用于服务器级归档的候选帖子数(排除置顶/锁定/黑名单频道): {len(candidate_threads_for_server_kill)}")
 
             if candidate_threads_for_server_kill:
                 get_msg_start = time.time()
-                thread_message_obj_list_server_level = await self._get_last_message_task(candidate_threads_for_server_kill)
+                thread_message_obj_list_server_level = await self._get_last_message_task(candidate_threads_for_server_kill, stats, last_message_cache)
                 get_msg_time = time.time() - get_msg_start
-                initial_log_info += f"\n  获取候选帖子 最后一条消息 耗时: {get_msg_time:.3f}s (S:{self.message_succeed_count}/F:{self.not_found_error_count})"
-
-                thread_message_obj_list_server_level.sort(key=lambda tm_obj: tm_obj.last_message.created_at)
+                run_log_parts.append(f"\n  获取候选帖子 最后一条消息 耗时: {get_msg_time:.3f}s (S:{stats.message_succeed_count}/F:{stats.not_found_error_count})")
 
-                threads_to_actually_archive_server_level = thread_message_obj_list_server_level[:kill_count_server_level]
-                initial_log_info += f"\n  将实际归档 (服务器级): {len(threads_to_actually_archive_server_level)} 个帖子"
+                # 只需最旧的 kill_count 个帖子，用堆选择代替整体排序
+                threads_to_actually_archive_server_level = heapq.nsmallest(
+                    kill_count_server_level,
+                    thread_message_obj_list_server_level,
+                    key=lambda tm_obj: tm_obj.last_message.created_at,
+                )
+                run_log_parts.append(f"\n  将实际归档 (服务器级): {len(threads_to_actually_archive_server_level)} 个帖子")
 
                 # 执行归档 (服务器级)
                 archive_task_start_time_sl = time.time()
 
+                server_level_processed_ids = {tm_obj.thread.id for tm_obj in threads_to_actually_archive_server_level}
+
                 if threads_to_actually_archive_server_level:
-                    initial_succeed_count = self.succeed_count
-                    initial_fail_count = self.fail_count
-                    await self._archive_thread_task(threads_to_actually_archive_server_level, settings)
-                    threads_archived_this_run = self.succeed_count - initial_succeed_count
+                    initial_succeed_count = stats.succeed_count
+                    initial_fail_count = stats.fail_count
+                    await self._archive_thread_task(threads_to_actually_archive_server_level, settings, stats, now_utc)
+                    threads_archived_this_run = stats.succeed_count - initial_succeed_count
                 archive_task_time_sl = time.time() - archive_task_start_time_sl
-                initial_log_info += f"\n  服务器级归档操作耗时: {archive_task_time_sl:.3f}s (成功:{self.succeed_count - initial_succeed_count}, 失败:{self.fail_count - initial_fail_count})"
+                run_log_parts.append(f"\n  服务器级归档操作耗时: {archive_task_time_sl:.3f}s (成功:{stats.succeed_count - initial_succeed_count}, 失败:{stats.fail_count - initial_fail_count})")
         else:
-            initial_log_info += f"\n服务器活跃帖数在目标 ({settings.max_active_threads}) 之内，无需归档操作。"
-            overall_summary_embed_description += f"> 服务器活跃帖数在目标内，无需归档操作。\n"
-
-        bot_log.info(initial_log_info)
+            run_log_parts.append(f"\n服务器活跃帖数在目标 ({settings.max_active_threads}) 之内，无需归档操作。")
+            summary_embed_parts.append(f"> 服务器活跃帖数在目标内，无需归档操作。\n")
 
         # --- 步骤 4: 基于频道的不活跃天数归档---
         if settings.inactivity_days > 0:
-            log_inactivity_phase = "\n开始检查各非黑名单频道中的不活跃帖子..."
-
-            blacklisted_forum_channel_ids_set = set(settings.blacklist_channel_ids)
+            run_log_parts.append("\n开始检查各非黑名单频道中的不活跃帖子...")
 
-            # 从之前获取的全服务器活跃帖子中筛选出仍在非黑名单频道内且仍然活跃（未被服务器级归档）的帖子
-            active_threads_for_inactivity_check = []
-            for t_obj in all_server_active_threads_list:
-                if (
-                    t_obj.parent_id not in blacklisted_forum_channel_ids_set
-                    and t_obj.id not in pinned_threads_set_server_wide
-                    and not t_obj.archived
-                    and not t_obj.locked
-                ):
-                    active_threads_for_inactivity_check.append(t_obj)
+            # 复用之前筛选出的候选帖，仅保留仍然活跃（未被服务器级归档）的帖子
+            active_threads_for_inactivity_check = [
+                t_obj for t_obj in archive_candidate_threads
+                if not t_obj.archived and t_obj.id not in server_level_processed_ids
+            ]
 
             if active_threads_for_inactivity_check:
-                log_inactivity_phase += f"\n  找到 {len(active_threads_for_inactivity_check)} 个在非黑名单频道中的活跃、非置顶帖进行不活跃检查"
+                run_log_parts.append(f"\n  找到 {len(active_threads_for_inactivity_check)} 个在非黑名单频道中的活跃、非置顶帖进行不活跃检查")
 
                 get_msg_start_ia = time.time()
-                current_msg_succeed = self.message_succeed_count
-                current_msg_fail = self.not_found_error_count
-                thread_message_obj_list_inactivity = await self._get_last_message_task(active_threads_for_inactivity_check)
+                current_msg_succeed = stats.message_succeed_count
+                current_msg_fail = stats.not_found_error_count
+                thread_message_obj_list_inactivity = await self._get_last_message_task(active_threads_for_inactivity_check, stats, last_message_cache)
                 get_msg_time_ia = time.time() - get_msg_start_ia
-                log_inactivity_phase += f"\n  获取不活跃检查帖子的最后一条消息耗时: {get_msg_time_ia:.3f}s (S:{self.message_succeed_count-current_msg_succeed}/F:{self.not_found_error_count-current_msg_fail})"
-
-                threads_to_archive_due_to_inactivity = []
-                now_utc_naive = datetime.now(timezone.utc).replace(tzinfo=None)
-                inactivity_threshold_date = now_utc_naive - timedelta(days=settings.inactivity_days)
+                run_log_parts.append(f"\n  获取不活跃检查帖子的最后一条消息耗时: {get_msg_time_ia:.3f}s (S:{stats.message_succeed_count-current_msg_succeed}/F:{stats.not_found_error_count-current_msg_fail})")
 
-                for tm_obj in thread_message_obj_list_inactivity:
-                    last_activity_naive = tm_obj.last_message.created_at.replace(tzinfo=None)
+                # 消息ID (snowflake) 中包含创建时间，与阈值时间对应的 snowflake 直接做整数比较；
+                # 获取失败的 ErrorMessage 没有ID，仍按时间比较
+                inactivity_threshold = now_utc - timedelta(days=settings.inactivity_days)
+                threshold_snowflake = discord.utils.time_snowflake(inactivity_threshold)
+                threads_to_archive_due_to_inactivity = [
+                    tm_obj for tm_obj in thread_message_obj_list_inactivity
+                    if (tm_obj.last_message.created_at < inactivity_threshold
+                        if isinstance(tm_obj.last_message, ErrorMessage)
+                        else tm_obj.last_message.id < threshold_snowflake)
+                ]
 
-                    if last_activity_naive < inactivity_threshold_date:
-                        threads_to_archive_due_to_inactivity.append(tm_obj)
-
-                log_inactivity_phase += f"\n  找到 {len(threads_to_archive_due_to_inactivity)} 个帖子因不活跃需要归档"
+                run_log_parts.append(f"\n  找到 {len(threads_to_archive_due_to_inactivity)} 个帖子因不活跃需要归档")
 
                 if threads_to_archive_due_to_inactivity:
                     archive_task_start_time_ia = time.time()
-                    initial_succeed_count_ia = self.succeed_count
-                    initial_fail_count_ia = self.fail_count
-                    await self._archive_thread_task(threads_to_archive_due_to_inactivity, settings)
-                    threads_archived_this_run += (self.succeed_count - initial_succeed_count_ia)
+                    initial_succeed_count_ia = stats.succeed_count
+                    initial_fail_count_ia = stats.fail_count
+                    await self._archive_thread_task(threads_to_archive_due_to_inactivity, settings, stats, now_utc, threshold_snowflake)
+                    threads_archived_this_run += (stats.succeed_count - initial_succeed_count_ia)
                     archive_task_time_ia = time.time() - archive_task_start_time_ia
-                    log_inactivity_phase += f"\n  不活跃帖子归档操作耗时: {archive_task_time_ia:.3f}s (成功:{self.succeed_count - initial_succeed_count_ia}, 失败:{self.fail_count - initial_fail_count_ia})"
+                    run_log_parts.append(f"\n  不活跃帖子归档操作耗时: {archive_task_time_ia:.3f}s (成功:{stats.succeed_count - initial_succeed_count_ia}, 失败:{stats.fail_count - initial_fail_count_ia})")
             else:
-                log_inactivity_phase += "\n  没有在监控频道中找到需要进行不活跃检查的帖子。"
-
-            bot_log.info(log_inactivity_phase)
+                run_log_parts.append("\n  没有在监控频道中找到需要进行不活跃检查的帖子。")
+        else:
+            run_log_parts.append(f"\n服务器 {settings.config_name} 未启用不活跃归档，跳过不活跃检查。")
 
         # --- 步骤 5: 日志与面板信息整理---
         global_finish_time = time.time()
-        log_result_summary = f"\n--- 运行总结 (索引: {run_hash_value}) ---"
-        log_result_summary += f"\n总计成功归档帖子: {self.succeed_count}"
-        log_result_summary += f"\n总计归档失败: {self.fail_count}"
-        log_result_summary += f"\n总计获取消息成功: {self.message_succeed_count}"
-        log_result_summary += f"\n总计获取消息失败: {self.not_found_error_count}"
-        log_result_summary += f"\n总运行耗时: {global_finish_time - global_start_time:.3f}秒"
-
-        if self.log_archived_info_details:
-            bot_log.info(f"\n--- 归档成功详情 (索引: {run_hash_value}) ---{self.log_archived_info_details}")
-        if self.log_get_message_error_details:
-            bot_log.warning(f"\n--- 获取消息失败详情 (索引: {run_hash_value}) ---{self.log_get_message_error_details}")
-        if self.log_archived_error_details:
-            bot_log.error(f"\n--- 归档失败详情 (索引: {run_hash_value}) ---{self.log_archived_error_details}")
-        bot_log.info(log_result_summary)
-
-        overall_summary_embed_description += f"\n> 总计归档成功/失败: **{self.succeed_count}** / **{self.fail_count}**\n"
-        if manual: overall_summary_embed_description += f"-# (手动触发)\n"
-
-        final_embed_color = Color.orange() if self.fail_count > 0 or self.not_found_error_count > 0 else Color.green()
+        log_result_summary = "".join([
+            f"\n--- 运行总结 (索引: {run_hash_value}) ---",
+            f"\n总计成功归档帖子: {stats.succeed_count}",
+            f"\n总计归档失败: {stats.fail_count}",
+            f"\n总计获取消息成功: {stats.message_succeed_count}",
+            f"\n总计获取消息失败: {stats.not_found_error_count}",
+            f"\n总运行耗时: {global_finish_time - global_start_time:.3f}秒",
+        ])
+
+        # 日志级别被过滤时跳过大段日志文本的拼接
+        if stats.log_get_message_error_details and bot_log.isEnabledFor(logging.WARNING):
+            bot_log.warning(f"\n--- 获取消息失败详情 (索引: {run_hash_value}) ---{''.join(stats.log_get_message_error_details)}")
+        if stats.log_archived_error_details and bot_log.isEnabledFor(logging.ERROR):
+            bot_log.error(f"\n--- 归档失败详情 (索引: {run_hash_value}) ---{''.join(stats.log_archived_error_details)}")
+
+        # 本次运行的过程日志、归档成功详情与总结合并为一条 INFO 日志输出
+        if bot_log.isEnabledFor(logging.INFO):
+            if stats.log_archived_info_records:
+                run_log_parts.append(f"\n--- 归档成功详情 (索引: {run_hash_value}) ---")
+                run_log_parts.extend(starmap(ARCHIVED_INFO_LINE_TEMPLATE.format, stats.log_archived_info_records))
+            run_log_parts.append(log_result_summary)
+            bot_log.info("".join(run_log_parts))
+
+        summary_embed_parts.append(f"\n> 总计归档成功/失败: **{stats.succeed_count}** / **{stats.fail_count}**\n")
+        if manual: summary_embed_parts.append(f"-# (手动触发)\n")
+
+        final_embed_color = Color.orange() if stats.fail_count > 0 or stats.not_found_error_count > 0 else Color.green()
         if threads_archived_this_run == 0 and kill_count_server_level <=0 :
              final_embed_color = Color.blue()
 
-        final_embed = Embed(title=f"归档报告: {settings.config_name}", description=overall_summary_embed_description, color=final_embed_color)
+        final_embed = Embed(title=f"归档报告: {settings.config_name}", description="".join(summary_embed_parts), color=final_embed_color)
         final_embed.set_author(name=current_run_timestamp_str)
 
-        if self.archive_run_details_for_embed:
-            details_text_parts = []
-            current_length = 0
+        if stats.archive_run_details_for_embed:
             max_field_length = 1000
 
-            for title, desc in self.archive_run_details_for_embed.items():
-                part = f"**{title}**\n{desc}\n"
-                if current_length + len(part) > max_field_length and details_text_parts:
-                    final_embed.add_field(name="部分归档详情", value="".join(details_text_parts), inline=False)
-                    details_text_parts = [part]
-                    current_length = len(part)
-                else:
-                    details_text_parts.append(part)
-                    current_length += len(part)
-
-            if details_text_parts: 
-                 final_embed.add_field(name="部分归档详情 (续)" if final_embed.fields else "部分归档详情", value="".join(details_text_parts), inline=False)
-
+            # 每条详情只格式化并计算一次长度，再按累计长度一次遍历划分各字段的区间
+            parts = [f"**{title}**\n{desc}\n" for title, desc in stats.archive_run_details_for_embed.items()]
+            boundaries = [0]
+            current_length = 0
+            for index, part_length in enumerate(map(len, parts)):
+                if current_length + part_length > max_field_length and index > boundaries[-1]:
+                    boundaries.append(index)
+                    current_length = 0
+                current_length += part_length
+            boundaries.append(len(parts))
+
+            field_count = len(boundaries) - 1
+            for field_index, (field_start, field_end) in enumerate(zip(boundaries, boundaries[1:])):
+                field_name = "部分归档详情 (续)" if field_index == field_count - 1 and field_index > 0 else "部分归档详情"
+                final_embed.add_field(name=field_name, value="".join(parts[field_start:field_end]), inline=False)
 
         if settings.notification_thread_id:
             try:
                 notif_channel = await self.fetch_channel(settings.notification_thread_id)
 
                 if isinstance(notif_channel, (TextChannel, Thread)):
+                    # 先发送报告，确保错误详情出现在其对应的报告之后；两条错误详情之间互不依赖，并发发送
                     await notif_channel.send(embed=final_embed)
+                    sends = []
+
+                    # 面板描述最多 4000 字符，只拼接所需的前若干条错误详情
+                    if stats.log_get_message_error_details:
+                        error_embed = Embed(title=f"警告: 获取消息出错↓", description=_join_limited(stats.log_get_message_error_details, 4000), color=Color.yellow())
+                        sends.append(notif_channel.send(embed=error_embed))
 
-                    if self.log_get_message_error_details:
-                        error_embed = Embed(title=f"警告: 获取消息出错↓", description=self.log_get_message_error_details[:4000], color=Color.yellow())
-                        await notif_channel.send(embed=error_embed)
+                    if stats.log_archived_error_details:
+                        error_embed = Embed(title=f"错误: 归档操作出错↓", description=_join_limited(stats.log_archived_error_details, 4000), color=Color.red())
+                        sends.append(notif_channel.send(embed=error_embed))
 
-                    if self.log_archived_error_details:
-                        error_embed = Embed(title=f"错误: 归档操作出错↓", description=self.log_archived_error_details[:4000], color=Color.red())
-                        await notif_channel.send(embed=error_embed)
+                    for result in await asyncio.gather(*sends, return_exceptions=True):
+                        if isinstance(result, Exception):
+                            bot_log.error(f"发送通知到频道 {settings.notification_thread_id} 失败: {result}")
 
             except Exception as e:
                 bot_log.error(f"发送最终通知到频道 {settings.notification_thread_id} 失败: {e}")
 
-    async def _get_last_message_task(self, thread_list: list[discord.Thread]) -> list[ThreadMessage]:
-        tasks_list = []
-
-        for thread_to_check in thread_list:
-            task = asyncio.create_task(self._get_last_message(thread_to_check))
-            tasks_list.append(task)
-            await asyncio.sleep(0.05) # 避免速率限制
+    async def _get_last_message_task(self, thread_list: list[discord.Thread], stats: AuditRunStats, last_message_cache: dict[int, discord.Message | ErrorMessage] | None = None) -> list[ThreadMessage]:
+        # last_message_cache 在同一次审计的多个阶段间共享，避免对同一帖子重复请求历史消息
+        if last_message_cache is None:
+            last_message_cache = {}
+        # 所有任务立即创建，由 self.http_sem 限制同时进行的请求数
+        tasks_list = [
+            asyncio.create_task(self._get_last_message(thread_to_check, stats, last_message_cache))
+            for thread_to_check in thread_list
+        ]
 
         results = await asyncio.gather(*tasks_list)
 
@@ -765,220 +999,282 @@ class ThreadArchiverBot(commands.Bot):
         ]
         return thread_obj_list
 
-    async def _get_last_message(self, thread: discord.Thread) -> discord.Message | ErrorMessage:
+    async def _get_last_message(self, thread: discord.Thread, stats: AuditRunStats, last_message_cache: dict[int, discord.Message | ErrorMessage]) -> discord.Message | discord.Object | ErrorMessage:
+        # 最后一条消息的发送时间已编码在其雪花ID中，有 last_message_id 时无需发起 HTTP 请求
+        if thread.last_message_id:
+            stats.message_succeed_count += 1
+            return discord.Object(id=thread.last_message_id)
+
+        # 本次审计中已获取过的帖子直接复用结果（包括获取失败的结果，避免重复请求和重复报告错误）
+        cached_message = last_message_cache.get(thread.id)
+        if cached_message is not None:
+            return cached_message
+
         try:
 
-            async for message_in_history in thread.history(limit=5):
-                if message_in_history:
-                    self.message_succeed_count += 1
+            async with self.http_sem:
+                async for message_in_history in thread.history(limit=1):
+                    stats.message_succeed_count += 1
+                    last_message_cache[thread.id] = message_in_history
                     return message_in_history
 
             # 如果循环结束没有找到消息
-            self.not_found_error_count += 1
+            stats.not_found_error_count += 1
             error_detail = f"\n  > 帖子 {thread.mention} 中未能找到消息"
 
-            self.log_get_message_error_details += error_detail #
-            bot_log.warning(f"获取帖子 {thread.name} (ID:{thread.id}) 的最后消息失败: history()迭代未返回消息")
-            return ErrorMessage(thread.created_at or datetime.now(timezone.utc))
+            stats.log_get_message_error_details.append(error_detail)
+            if bot_log.isEnabledFor(logging.WARNING):
+                bot_log.warning(f"获取帖子 {thread.name} (ID:{thread.id}) 的最后消息失败: history()迭代未返回消息")
 
         except discord.Forbidden:
-            self.not_found_error_count += 1
+            stats.not_found_error_count += 1
             error_detail = f"\n  > 帖子 {thread.mention} 无权限访问其历史记录"
-            self.log_get_message_error_details += error_detail
-            bot_log.warning(f"获取帖子 {thread.name} (ID:{thread.id}) 的最后消息失败: 无权限(Forbidden)。")
-            return ErrorMessage(thread.created_at or datetime.now(timezone.utc))
+            stats.log_get_message_error_details.append(error_detail)
+            if bot_log.isEnabledFor(logging.WARNING):
+                bot_log.warning(f"获取帖子 {thread.name} (ID:{thread.id}) 的最后消息失败: 无权限(Forbidden)。")
 
         except Exception as e:
-            self.not_found_error_count += 1
+            stats.not_found_error_count += 1
             error_detail = f"\n  > 帖子 {thread.mention} 获取其消息时发生错误↙\n{e}"
-            self.log_get_message_error_details += error_detail
-            bot_log.error(f"获取帖子 {thread.name} (ID:{thread.id}) 的最后消息时发生异常: {e}", exc_info=False)
-            return ErrorMessage(thread.created_at or datetime.now(timezone.utc))
+            stats.log_get_message_error_details.append(error_detail)
+            if bot_log.isEnabledFor(logging.ERROR):
+                bot_log.error(f"获取帖子 {thread.name} (ID:{thread.id}) 的最后消息时发生异常: {e}", exc_info=False)
+
+        # 获取失败时以帖子创建时间近似最后活跃时间（旧帖子可能没有创建时间，才会取当前时间）
+        error_message = ErrorMessage(thread.created_at or datetime.now(timezone.utc))
+        last_message_cache[thread.id] = error_message
+        return error_message
 
-    async def _archive_thread_task(self, thread_obj_list: list[ThreadMessage], settings: GuildArchiveSettings): #
-        tasks_list = []
+    async def _archive_thread_task(self, thread_obj_list: list[ThreadMessage], settings: GuildArchiveSettings, stats: AuditRunStats, now_utc: datetime, inactivity_threshold_snowflake: int | None = None):
+        """
+        并发归档一批帖子，now_utc 为本次审计开始时间，整批帖子共用它计算不活跃时长
+        inactivity_threshold_snowflake 仅用于不活跃归档：归档前若帖子缓存的最后消息ID已不早于该阈值（期间有新消息），则跳过该帖子
+        """
+        # 所有任务立即创建，由 self.http_sem 限制同时进行的归档请求数
+
+        async def _run(tm_obj: ThreadMessage) -> ArchiveResult | None:
+            async with self.http_sem:
+                result = await self._archive_thread(tm_obj.thread, tm_obj.last_message, settings, now_utc, inactivity_threshold_snowflake)
+                if result is not None:
+                    await asyncio.sleep(self._archive_delay)
+                return result
+
+        delay_before_batch = self._archive_delay
+        tasks_list = [asyncio.create_task(_run(tm_obj)) for tm_obj in thread_obj_list]
+        results = await asyncio.gather(*tasks_list, return_exceptions=True)
+
+        # 各任务只返回结果，全部完成后按帖子顺序统一汇总，序号因此与输入顺序一致（跳过的帖子不计入）
+        for tm_obj, result in zip(thread_obj_list, results):
+            if isinstance(result, ArchiveResult):
+                stats.add_archive_result(result)
+            elif isinstance(result, Exception):
+                # _archive_thread 的 try 之外抛出的异常（如格式化时间失败）同样计为归档失败
+                bot_log.error(f"归档帖子 {tm_obj.thread.name} (ID:{tm_obj.thread.id}) 时发生异常: {result}", exc_info=result)
+                stats.add_archive_result(ArchiveResult(tm_obj.thread, "未知", "未知", "未知", result))
+
+        # 本批未触发速率限制（间隔未被调大）时逐步缩短间隔
+        if self._archive_delay <= delay_before_batch:
+            self._archive_delay = max(self._archive_delay * 0.9, ARCHIVE_DELAY_MIN)
+
+    async def _audit_pinned_thread_messages(self, guild: Guild, settings: GuildArchiveSettings, pinned_thread_ids: set[int], stats: AuditRunStats, now_utc: datetime) -> str:
+        """审计置顶帖中的漏监听消息（各置顶帖并发审计）"""
+        # 日志按片段收集，返回时再一次性拼接
+        log_parts = [f"\n置顶帖消息审计:"]
+        
+        # 获取所有置顶帖（get_thread 只查询缓存，找不到时返回 None），只处理非锁定的置顶帖
+        pinned_threads = [
+            thread for thread_id in pinned_thread_ids
+            if (thread := guild.get_thread(thread_id)) is not None and not thread.locked
+        ]
+        
+        log_parts.append(f"\n  找到 {len(pinned_threads)} 个非锁定置顶帖进行审计")
+
+        # 只审计没有记录或最后消息ID与记录不一致（即有新消息）的置顶帖
+        pinned_last_messages = self.pinned_last_messages
+        threads_to_audit = [
+            (thread, stored_last_message_id) for thread in pinned_threads
+            if (stored_last_message_id := pinned_last_messages.get(thread.id)) is None
+            or stored_last_message_id != thread.last_message_id
+        ]
 
-        for tm_obj in thread_obj_list:
-            task = asyncio.create_task(self._archive_thread(tm_obj.thread, tm_obj.last_message, settings)) #
-            tasks_list.append(task)
-            await asyncio.sleep(0.05)
+        # 只检查3天内的消息：消息ID (snowflake) 中包含创建时间，所有置顶帖共用同一个阈值ID做整数比较
+        cutoff_snowflake = discord.utils.time_snowflake(now_utc - timedelta(days=3))
 
-        await asyncio.gather(*tasks_list)
+        results = await asyncio.gather(*(
+            self._audit_one_pinned_thread(thread, stored_last_message_id, settings, cutoff_snowflake)
+            for thread, stored_last_message_id in threads_to_audit
+        ))
 
-    async def _audit_pinned_thread_messages(self, guild: Guild, settings: GuildArchiveSettings, pinned_thread_ids: set[int]) -> str:
-        """审计置顶帖中的漏监听消息"""
-        log_info = f"\n置顶帖消息审计:"
+        # 按置顶帖顺序汇总各帖子的日志与审计详情
         deleted_count = 0
-        checked_count = 0
-        audit_details = []
+        records_updated = False
+        for thread_log_parts, audit_detail, thread_deleted_count, record_updated in results:
+            log_parts.extend(thread_log_parts)
+            deleted_count += thread_deleted_count
+            records_updated = records_updated or record_updated
+            stats.add_embed_detail(*audit_detail)
+
+        # 所有置顶帖审计完成后统一写入一次最后消息ID记录
+        if records_updated:
+            await self._save_pinned_last_messages()
         
-        # 获取所有置顶帖
-        pinned_threads = []
-        for thread_id in pinned_thread_ids:
+        log_parts.append(f"\n  审计完成: 检查了 {len(pinned_threads)} 个置顶帖，删除了 {deleted_count} 条消息")
+        return "".join(log_parts)
+
+    async def _audit_one_pinned_thread(self, thread: discord.Thread, stored_last_message_id: int | None, settings: GuildArchiveSettings, cutoff_snowflake: int) -> tuple[list[str], tuple[str, str], int, bool]:
+        """
+        审计单个检测到新消息的置顶帖（stored_last_message_id 为上次记录的最后消息ID），返回 (日志片段, 面板详情 (标题, 描述), 删除的消息数, 是否更新了最后消息ID记录)
+        最后消息ID只更新内存记录，由调用方在全部审计完成后统一保存
+        """
+        log_parts = []
+        deleted_count = 0
+        try:
+            current_last_message_id = thread.last_message_id
+            log_parts.append(f"\n  [新消息检测] {thread.name} (ID: {thread.id})")
+            
+            # 添加到embed详情
+            audit_key = f"[审计] {thread.name}"
+            if stored_last_message_id is None:
+                audit_desc = f"> 首次检测，拉取最新消息进行审计"
+            else:
+                audit_desc = f"> 检测到变化，拉取最新消息审计"
+            
+            # 拉取最新的一批消息（固定数量）
+            recent_messages = []
             try:
-                thread = guild.get_thread(thread_id)
-                if thread and not thread.locked:  # 只处理非锁定的置顶帖
-                    pinned_threads.append(thread)
+                async with self.http_sem:
+                    async for message in thread.history(limit=50):
+                        recent_messages.append(message)
+            except discord.Forbidden:
+                log_parts.append(f" -> 无权限访问历史记录")
+                audit_desc += "\n> 无权限访问历史记录"
+                return log_parts, (audit_key, audit_desc), 0, False
             except Exception as e:
-                bot_log.warning(f"获取置顶帖 {thread_id} 失败: {e}")
-        
-        log_info += f"\n  找到 {len(pinned_threads)} 个非锁定置顶帖进行审计"
-        
-        for thread in pinned_threads:
-            try:
-                checked_count += 1
-                current_last_message_id = thread.last_message_id
-                stored_last_message_id = self.pinned_last_messages.get(thread.id)
+                log_parts.append(f" -> 获取历史记录失败: {e}")
+                audit_desc += f"\n> 获取历史记录失败: {e}"
+                return log_parts, (audit_key, audit_desc), 0, False
+            
+            if recent_messages:
+                log_parts.append(f" -> 拉取了 {len(recent_messages)} 条最新消息")
+                audit_desc += f"\n> 拉取了 {len(recent_messages)} 条最新消息"
                 
-                # 如果没有记录或当前ID与记录不一致，说明有新消息
-                if stored_last_message_id is None or current_last_message_id != stored_last_message_id:
-                    log_info += f"\n  [新消息检测] {thread.name} (ID: {thread.id})"
-                    
-                    # 添加到embed详情
-                    audit_key = f"[审计] {thread.name}"
-                    if stored_last_message_id is None:
-                        audit_desc = f"> 首次检测，拉取最新消息进行审计"
-                    else:
-                        audit_desc = f"> 检测到变化，拉取最新消息审计"
-                    
-                    # 拉取最新的一批消息（固定数量）
-                    recent_messages = []
-                    try:
-                        async for message in thread.history(limit=50):
-                            recent_messages.append(message)
-                    except discord.Forbidden:
-                        log_info += f" -> 无权限访问历史记录"
-                        audit_desc += "\n> 无权限访问历史记录"
-                        audit_details.append((audit_key, audit_desc))
+                # 筛选需要删除的消息（ID 不早于 cutoff_snowflake，即3天内的消息）
+                messages_to_delete = []
+                processed_count = 0
+                # 同一用户常连续发送多条消息，豁免判断结果按用户ID缓存（本帖内有效）
+                exempt_cache: dict[int, bool] = {}
+                for message in recent_messages:
+                    # 检查消息时间是否在3天内
+                    if message.id < cutoff_snowflake:
                         continue
-                    except Exception as e:
-                        log_info += f" -> 获取历史记录失败: {e}"
-                        audit_desc += f"\n> 获取历史记录失败: {e}"
-                        audit_details.append((audit_key, audit_desc))
+                    # 跳过BOT自己的消息（如保活刷新消息，由 delete_after 自行删除）
+                    if message.author.id == self.user.id:
                         continue
+
+                    processed_count += 1
                     
-                    if recent_messages:
-                        log_info += f" -> 拉取了 {len(recent_messages)} 条最新消息"
-                        audit_desc += f"\n> 拉取了 {len(recent_messages)} 条最新消息"
-                        
-                        # 筛选需要删除的消息（3天内的消息）
-                        now_utc = datetime.now(timezone.utc)
-                        three_days_ago = now_utc - timedelta(days=3)
-                        
-                        deleted_messages_info = []
-                        processed_count = 0
-                        for message in recent_messages:
-                            # 检查消息时间是否在3天内
-                            if message.created_at < three_days_ago:
-                                continue
-                            
-                            processed_count += 1
-                            
-                            # 检查用户是否在白名单中
-                            author = message.author
-                            
-                            if self._is_user_exempt(author, thread, settings):
-                                continue
-                            
-                            # 删除消息
-                            try:
-                                await message.delete()
-                                deleted_count += 1
-                                log_info += f"\n    [已删除] 用户 {author.name} 的消息 (ID: {message.id})"
-                                deleted_messages_info.append(f"用户 {author.name} 的消息 (ID: {message.id})")
-                            except discord.Forbidden:
-                                log_info += f"\n    [删除失败] 无权限删除消息 (ID: {message.id})"
-                                deleted_messages_info.append(f"无权限删除消息 (ID: {message.id})")
-                            except discord.NotFound:
-                                # 消息可能已经被删除
-                                pass
-                            except Exception as e:
-                                log_info += f"\n    [删除失败] 消息 {message.id}: {e}"
-                                deleted_messages_info.append(f"删除失败: {message.id} ({e})")
-                        
-                        if processed_count > 0:
-                            audit_desc += f"\n> 检查了 {processed_count} 条3天内消息"
-                        if deleted_messages_info:
-                            deleted_lines = "\n> ".join(deleted_messages_info)
-                            audit_desc += "\n> 删除操作: " + deleted_lines
-                    
-                    # 更新最后消息ID记录
-                    if current_last_message_id:
-                        self.pinned_last_messages[thread.id] = current_last_message_id
-                        await self._save_pinned_last_messages()
-                        log_info += f" -> 已更新最后消息ID: {current_last_message_id}"
-                        audit_desc += f"\n> 已更新最后消息ID: {current_last_message_id}"
-                    
-                    audit_details.append((audit_key, audit_desc))
+                    # 检查用户是否在白名单中
+                    author = message.author
+                    exempt = exempt_cache.get(author.id)
+                    if exempt is None:
+                        exempt = exempt_cache[author.id] = self._is_user_exempt(author, thread, settings)
+                    if exempt:
+                        continue
+
+                    messages_to_delete.append(message)
+
+                # 逐条删除（并发，由 self.http_sem 限制同时进行的请求数），返回 True 表示已删除；消息已不存在（可能已被删除）时返回 False
+                async def _delete(message: discord.Message) -> bool:
+                    async with self.http_sem:
+                        with contextlib.suppress(discord.NotFound):
+                            await message.delete()
+                            return True
+                    return False
+
+                # 优先批量删除：最多拉取 50 条且均为 3 天内的消息，满足批量删除 100 条、14 天内的限制
+                delete_results = []
+                if messages_to_delete:
+                    try:
+                        async with self.http_sem:
+                            await thread.delete_messages(messages_to_delete, reason="置顶帖消息审计")
+                        delete_results = [True] * len(messages_to_delete)
+                    except discord.Forbidden as e:
+                        delete_results = [e] * len(messages_to_delete)
+                    except discord.HTTPException as e:
+                        # 批量删除失败（如其中有消息已被删除）时退回逐条删除
+                        bot_log.warning(f"批量删除置顶帖 {thread.name} (ID: {thread.id}) 中的消息失败，改为逐条删除: {e}")
+                        delete_results = await asyncio.gather(
+                            *(_delete(message) for message in messages_to_delete), return_exceptions=True
+                        )
+
+                deleted_messages_info = []
+                for message, result in zip(messages_to_delete, delete_results):
+                    if result is True:
+                        deleted_count += 1
+                        log_parts.append(f"\n    [已删除] 用户 {message.author.name} 的消息 (ID: {message.id})")
+                        deleted_messages_info.append(f"用户 {message.author.name} 的消息 (ID: {message.id})")
+                    elif isinstance(result, discord.Forbidden):
+                        log_parts.append(f"\n    [删除失败] 无权限删除消息 (ID: {message.id})")
+                        deleted_messages_info.append(f"无权限删除消息 (ID: {message.id})")
+                    elif isinstance(result, Exception):
+                        log_parts.append(f"\n    [删除失败] 消息 {message.id}: {result}")
+                        deleted_messages_info.append(f"删除失败: {message.id} ({result})")
                 
-            except Exception as e:
-                log_info += f"\n  [审计失败] 处理 {thread.name} 时发生错误: {e}"
-                audit_key = f"[审计失败] {thread.name}"
-                audit_desc = f"> 处理时发生错误: {e}"
-                audit_details.append((audit_key, audit_desc))
-        
-        # 将审计详情添加到embed字段
-        for audit_key, audit_desc in audit_details:
-            if len(self.archive_run_details_for_embed) < 10:
-                self.archive_run_details_for_embed[audit_key] = audit_desc
-        
-        log_info += f"\n  审计完成: 检查了 {checked_count} 个置顶帖，删除了 {deleted_count} 条消息"
-        return log_info
+                if processed_count > 0:
+                    audit_desc += f"\n> 检查了 {processed_count} 条3天内消息"
+                if deleted_messages_info:
+                    deleted_lines = "\n> ".join(deleted_messages_info)
+                    audit_desc += "\n> 删除操作: " + deleted_lines
+            
+            # 更新最后消息ID记录
+            record_updated = False
+            if current_last_message_id:
+                self.pinned_last_messages[thread.id] = current_last_message_id
+                record_updated = True
+                log_parts.append(f" -> 已更新最后消息ID: {current_last_message_id}")
+                audit_desc += f"\n> 已更新最后消息ID: {current_last_message_id}"
+            
+            return log_parts, (audit_key, audit_desc), deleted_count, record_updated
+            
+        except Exception as e:
+            log_parts.append(f"\n  [审计失败] 处理 {thread.name} 时发生错误: {e}")
+            return log_parts, (f"[审计失败] {thread.name}", f"> 处理时发生错误: {e}"), deleted_count, False
 
-    async def _archive_thread(self, thread: discord.Thread, last_msg_obj: discord.Message | ErrorMessage, settings: GuildArchiveSettings):
+    async def _archive_thread(self, thread: discord.Thread, last_msg_obj: discord.Message | discord.Object | ErrorMessage, settings: GuildArchiveSettings, now_utc: datetime, inactivity_threshold_snowflake: int | None = None) -> ArchiveResult | None:
+        """归档单个帖子，返回归档结果，由调用方统一汇总到本次运行的统计中；帖子已重新活跃而跳过时返回 None"""
         archive_reason = f"自动归档"
 
+        # active_threads() 返回的帖子对象不在网关缓存中，其 last_message_id 不会更新；
+        # 这里读取缓存中的同一帖子（由网关事件更新），若筛选后收到了新消息则不再发起归档请求
+        if inactivity_threshold_snowflake is not None:
+            cached_thread = thread.guild.get_thread(thread.id)
+            if (cached_thread is not None and cached_thread.last_message_id
+                    and cached_thread.last_message_id >= inactivity_threshold_snowflake):
+                return None
+
         if isinstance(last_msg_obj, ErrorMessage):
-            created_at_str = thread.created_at.strftime('%Y-%m-%d %H:%M') if thread.created_at else "未知时间"
+            created_at_str = f"{thread.created_at:%Y-%m-%d %H:%M}" if thread.created_at else "未知时间"
             last_message_time_str = f"未知(帖子创建于 {created_at_str})"
             hours_diff_str = "未知"
+            days_diff_str = "未知"
 
         else:
-            last_message_time_str = last_msg_obj.created_at.strftime('%Y-%m-%d %H:%M')
-            now_utc = datetime.now(timezone.utc)
-            time_diff = now_utc - last_msg_obj.created_at
-            hours_diff = time_diff.total_seconds() / 3600
-            hours_diff_str = f"{hours_diff:.2f} 小时前"
-            days_diff = time_diff.total_seconds() / 86400
-            days_diff_str = f"{days_diff:.2f} 天前"
-
-        archive_category = None
-        if settings.archive_category_id:
-            archive_category = thread.guild.get_channel(settings.archive_category_id)
-            if not isinstance(archive_category, CategoryChannel):
-                archive_category = None
+            last_message_time_str = f"{last_msg_obj.created_at:%Y-%m-%d %H:%M}"
+            seconds_diff = (now_utc - last_msg_obj.created_at).total_seconds()
+            hours_diff_str = f"{seconds_diff / 3600:.2f} 小时前"
+            days_diff_str = f"{seconds_diff / 86400:.2f} 天前"
 
         try:
-            action_taken = False
-            start_time = time.time()
-
-            # 实际归档操作
+            # 实际归档操作，已归档的帖子无需再请求一次
             if not thread.archived:
                 await thread.edit(archived=True, reason=archive_reason)
-                action_taken = True
-
-            if action_taken or thread.archived:
-                self.succeed_count += 1
-                log_line = f"\n  - [{self.succeed_count}] {thread.name} | {thread.id} | 最后活跃时间: {last_message_time_str} ({hours_diff_str})"
-                self.log_archived_info_details += log_line
-
-                embed_title_key = f"[T{self.succeed_count}] 归档成功↓"
-                embed_value_desc = f"> {thread.mention}\n> 最后活跃时间: {last_message_time_str} ({days_diff_str})"
-
-                if len(self.archive_run_details_for_embed) < 10:
-                    self.archive_run_details_for_embed[embed_title_key] = embed_value_desc #
+            return ArchiveResult(thread, last_message_time_str, hours_diff_str, days_diff_str)
 
         except Exception as e:
-            self.fail_count += 1
-            log_line = f"\n  - [E{self.fail_count}] {thread.name} (ID:{thread.id}) | 最后一条消息: {last_message_time_str} ({hours_diff_str}) | 错误: {e}"
-            self.log_archived_error_details += log_line
-            embed_title_key = f"[E{self.fail_count}] 归档失败"
-            embed_value_desc = f"- ID:{thread.id} {thread.mention}\n- 最后一条消息: {last_message_time_str} ({hours_diff_str})\n- 错误: {str(e)[:100]}"
-
-            if len(self.archive_run_details_for_embed) < 10:
-                 self.archive_run_details_for_embed[embed_title_key] = embed_value_desc
-
+            if isinstance(e, discord.HTTPException) and e.status == 429:
+                self._archive_delay = min(self._archive_delay * 2, ARCHIVE_DELAY_MAX)
             bot_log.error(f"归档帖子 {thread.name} (ID:{thread.id}) 失败: {e}", exc_info=False)
+            return ArchiveResult(thread, last_message_time_str, hours_diff_str, days_diff_str, e)
 
 # --- 命令管理 ---
 class ArchiveManagerCog(commands.Cog):
@@ -999,23 +1295,16 @@ class ArchiveManagerCog(commands.Cog):
                                     config_name: str, inactivity_days: int, max_active_posts: int, max_active_threads: int):
         await interaction.response.defer(ephemeral=True)
 
-        target_setting: GuildArchiveSettings | None = None
-        guild_id_to_update: int | None = None
-
-        for gid, setting_obj in self.bot.guild_settings_map.items():
-            if setting_obj.config_name == config_name:
-                target_setting = setting_obj
-                guild_id_to_update = gid
-                break
-
-        if not target_setting or not guild_id_to_update:
+        resolved = self.bot.resolve_config(config_name)
+        if not resolved:
             await interaction.followup.send(f"错误：未找到名为 '{config_name}' 的服务器配置。", ephemeral=True)
             return
+        guild_id_to_update, target_setting = resolved
 
         target_setting.inactivity_days = inactivity_days if inactivity_days >= 0 else target_setting.inactivity_days
         target_setting.max_active_posts = max_active_posts if max_active_posts >= 0 else target_setting.max_active_posts
 
-        await self.bot.save_guild_setting(guild_id_to_update)
+        self.bot.mark_dirty(guild_id_to_update)
 
         embed = Embed(title="归档规则已更新", color=Color.green())
         embed.description = (
@@ -1034,18 +1323,11 @@ class ArchiveManagerCog(commands.Cog):
     async def manual_guild_archive_cmd(self, interaction: discord.Interaction, config_name: str):
         await interaction.response.defer(ephemeral=True, thinking=True)
 
-        target_setting: GuildArchiveSettings | None = None
-        guild_id_to_process: int | None = None
-
-        for gid, setting_obj in self.bot.guild_settings_map.items():
-            if setting_obj.config_name == config_name:
-                target_setting = setting_obj
-                guild_id_to_process = gid
-                break
-
-        if not target_setting or not guild_id_to_process:
+        resolved = self.bot.resolve_config(config_name)
+        if not resolved:
             await interaction.followup.send(f"错误：未找到名为 '{config_name}' 的服务器配置。", ephemeral=True)
             return
+        guild_id_to_process, target_setting = resolved
 
         guild = self.bot.get_guild(guild_id_to_process)
         if not guild:
@@ -1070,17 +1352,12 @@ class ArchiveManagerCog(commands.Cog):
         embeds_to_send = []
 
         if config_name:
-            found_setting: GuildArchiveSettings | None = None
-            for setting in self.bot.guild_settings_map.values():
-                if setting.config_name == config_name:
-                    found_setting = setting
-                    break
-
-            if not found_setting:
+            resolved = self.bot.resolve_config(config_name)
+            if not resolved:
                 await interaction.followup.send(f"未找到名为 '{config_name}' 的服务器配置。", ephemeral=True)
                 return
 
-            settings_list = [found_setting]
+            settings_list = [resolved[1]]
 
         else:
             settings_list = list(self.bot.guild_settings_map.values())
@@ -1090,6 +1367,10 @@ class ArchiveManagerCog(commands.Cog):
                 return
 
         for setting in settings_list:
+            if setting._cached_embed_dict is not None:
+                embeds_to_send.append(Embed.from_dict(setting._cached_embed_dict))
+                continue
+
             embed = Embed(title=f"配置: {setting.config_name}", color=Color.blue())
             embed.add_field(name="服务器ID", value=str(setting.guild_id), inline=False)
             embed.add_field(name="黑名单频道ID", value=", ".join(map(str, setting.blacklist_channel_ids)) or "未设置", inline=False)
@@ -1106,11 +1387,15 @@ class ArchiveManagerCog(commands.Cog):
 
             if setting.last_notice_message_id:
                 embed.add_field(name="上次通知消息ID", value=str(setting.last_notice_message_id), inline=False)
+            setting._cached_embed_dict = embed.to_dict()
             embeds_to_send.append(embed)
 
         if embeds_to_send:
-            for i in range(0, len(embeds_to_send), 10):
-                await interaction.followup.send(embeds=embeds_to_send[i:i+10], ephemeral=True)
+            # 每条消息最多 10 个 embed，各批次并发发送
+            await asyncio.gather(*(
+                interaction.followup.send(embeds=embeds_to_send[i:i+10], ephemeral=True)
+                for i in range(0, len(embeds_to_send), 10)
+            ))
         else:
             await interaction.followup.send("未能生成配置信息。",ephemeral=True)
 
@@ -1125,6 +1410,14 @@ def main_bot_runner():
         bot_log.critical("未能从环境变量 BOT_TOKEN 读取机器人令牌。请在 .env 中配置 BOT_TOKEN。")
         return
 
+    # 可选：安装了 uvloop 时使用其事件循环，未安装则沿用默认的 asyncio 事件循环
+    try:
+        import uvloop
+        uvloop.install()
+        bot_log.info("已启用 uvloop 事件循环。")
+    except ImportError:
+        pass
+
     try:
         bot.run(bot.bot_token)
     except discord.LoginFailure:
@@ -1135,4 +1428,8 @@ def main_bot_runner():
         bot_log.info("机器人已关闭。")
 
 if __name__ == "__main__":
-    main_bot_runner()
+    try:
+        main_bot_runner()
+    finally:
+        # 写出队列中剩余的日志
+        log_listener.stop()